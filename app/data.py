@@ -5,9 +5,18 @@
 """
 import datetime as dt
 import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
 try:
@@ -15,47 +24,204 @@ try:
 except ImportError:
     adata = None
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import ciso8601
+except ImportError:
+    ciso8601 = None
+
 logger = logging.getLogger(__name__)
 
 CACHE_DIR = Path("./cache")
 CACHE_DIR.mkdir(exist_ok=True)
 
+# mkstemp 创建的文件权限为 0600，写完后按当前 umask 恢复默认权限
+# (os.umask 只能"设置并返回"，在导入时读取一次，避免运行期多线程竞争)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+CACHE_FILE_MODE = 0o666 & ~_UMASK
+
+# 被中断的写入会留下临时文件，超过该时长(秒)的临时文件在下次写入时清理
+STALE_TMP_SECONDS = 3600
+
+# 进程内行情缓存: 最多保留的条目数与各 k_type 的过期时间(秒)
+MEMO_MAX_ENTRIES = 128
+MEMO_TTL_SECONDS = {1: 60, 2: 300, 3: 600}
 
-def _cache_path(code: str, period: str) -> Path:
+_MemoKey = Tuple[str, str, Optional[str], Optional[str]]
+_memo: "OrderedDict[_MemoKey, Tuple[float, pd.DataFrame]]" = OrderedDict()
+_memo_lock = threading.Lock()
+# 按键分配的锁及其引用计数，无人持有或等待时即删除
+_key_locks: Dict[Hashable, List] = {}
+_key_locks_guard = threading.Lock()
+
+# 实时行情分批请求: 每批代码数、并发数、失败重试次数
+REALTIME_CHUNK_SIZE = 80
+REALTIME_MAX_WORKERS = 8
+REALTIME_MAX_RETRIES = 2
+
+# 日期列的优先级（从高到低）
+_DATE_COLUMNS = ("trade_time", "trade_date", "日期", "时间", "date", "Date")
+
+# 周期字符串到 adata k_type 的映射
+_PERIOD_MAP = {
+    "daily": 1,
+    "day": 1,
+    "d": 1,
+    "1d": 1,
+    "weekly": 2,
+    "week": 2,
+    "w": 2,
+    "1w": 2,
+    "monthly": 3,
+    "month": 3,
+    "m": 3,
+    "1m": 3,
+}
+
+# 常见的日期格式，按顺序尝试匹配
+_INFER_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y%m%d")
+
+# 标准列名映射
+_COLUMN_MAP = {
+    # 价格相关
+    "开盘": "open",
+    "open": "open",
+    "Open": "open",
+    "收盘": "close",
+    "close": "close",
+    "Close": "close",
+    "最高": "high",
+    "high": "high",
+    "High": "high",
+    "最低": "low",
+    "low": "low",
+    "Low": "low",
+    # 成交量
+    "成交量": "volume",
+    "volume": "volume",
+    "Volume": "volume",
+}
+
+
+def _cache_path(code: str, period: str, suffix: str = ".parquet") -> Path:
     """生成缓存文件路径"""
     safe_code = code.replace("/", "_")
-    return CACHE_DIR / f"{safe_code}_{period}.csv"
+    return CACHE_DIR / f"{safe_code}_{period}{suffix}"
 
 
 def _load_cache(code: str, period: str) -> Optional[pd.DataFrame]:
-    """从缓存文件加载数据"""
-    path = _cache_path(code, period)
-    if not path.exists():
-        return None
+    """从缓存文件加载数据，优先读取 Parquet，兼容旧的 CSV 缓存"""
+    parquet_path = _cache_path(code, period)
+    csv_path = _cache_path(code, period, suffix=".csv")
     try:
-        df = pd.read_csv(path, parse_dates=["date"])
-        logger.info("命中缓存: %s", path)
-        return df
+        if pyarrow is not None and parquet_path.exists():
+            df = pd.read_parquet(parquet_path)
+            logger.info("命中缓存: %s", parquet_path)
+            return df
+        if csv_path.exists():
+            if pyarrow is not None:
+                # 使用 numpy 类型 (与读取 Parquet 一致)；timestamp 显式按字符串读取，
+                # 避免 pyarrow 将其推断为日期
+                df = pd.read_csv(
+                    csv_path, engine="pyarrow", parse_dates=["date"], dtype={"timestamp": "str"}
+                )
+                logger.info("命中缓存: %s", csv_path)
+                # 迁移为 Parquet，旧 CSV 只需解析一次
+                _save_cache(code, period, df)
+                return df
+            df = pd.read_csv(csv_path, parse_dates=["date"])
+            logger.info("命中缓存: %s", csv_path)
+            return df
     except Exception as exc:
         logger.warning("读取缓存失败: %s", exc)
-        return None
+    return None
+
+
+def _sweep_stale_tmp(path: Path) -> None:
+    """清理该缓存文件遗留的临时文件，只删除足够旧的，避免误删其他进程正在写入的文件"""
+    cutoff = time.time() - STALE_TMP_SECONDS
+    for tmp_path in path.parent.glob(f"{path.name}.*.tmp"):
+        try:
+            if tmp_path.stat().st_mtime < cutoff:
+                tmp_path.unlink()
+        except OSError:
+            continue
 
 
 def _save_cache(code: str, period: str, df: pd.DataFrame) -> None:
-    """保存数据到缓存文件"""
-    path = _cache_path(code, period)
-    try:
-        df.to_csv(path, index=False)
-        logger.info("已写入缓存: %s", path)
-    except Exception as exc:
-        logger.warning("写入缓存失败: %s", exc)
+    """
+    保存数据到缓存文件，未安装 pyarrow 时回退为 CSV
+    每次写入使用独立的临时文件再原子替换，避免中断或并发写入时留下残缺的缓存
+    """
+    path = _cache_path(code, period) if pyarrow is not None else _cache_path(code, period, suffix=".csv")
+    # 同一缓存文件的写入在进程内串行执行，不同 start/end 的请求也共用这把锁
+    with _key_lock(("cache_file", code, period)):
+        _sweep_stale_tmp(path)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+        try:
+            if pyarrow is not None:
+                df.to_parquet(tmp_path, compression="zstd", index=False)
+            else:
+                df.to_csv(tmp_path, index=False)
+            os.chmod(tmp_path, CACHE_FILE_MODE)
+            os.replace(tmp_path, path)
+            logger.info("已写入缓存: %s", path)
+        except Exception as exc:
+            logger.warning("写入缓存失败: %s", exc)
+            tmp_path.unlink(missing_ok=True)
+
+
+def _memo_get(key: _MemoKey) -> Optional[pd.DataFrame]:
+    """读取进程内缓存，过期条目直接淘汰"""
+    ttl = MEMO_TTL_SECONDS.get(_period_to_k_type(key[1]), 60)
+    with _memo_lock:
+        entry = _memo.get(key)
+        if entry is None:
+            return None
+        stored_at, df = entry
+        if time.monotonic() - stored_at > ttl:
+            del _memo[key]
+            return None
+        _memo.move_to_end(key)
+    return df.copy(deep=False)
+
+
+def _memo_put(key: _MemoKey, df: pd.DataFrame) -> None:
+    """写入进程内缓存，超出容量时淘汰最久未使用的条目"""
+    with _memo_lock:
+        _memo[key] = (time.monotonic(), df)
+        _memo.move_to_end(key)
+        while len(_memo) > MEMO_MAX_ENTRIES:
+            _memo.popitem(last=False)
+
+
+def invalidate(code: str, period: Optional[str] = None) -> None:
+    """
+    使进程内缓存失效，在有新K线写入时调用
+
+    Args:
+        code: 股票代码
+        period: 周期类型，为 None 时清除该股票的所有周期
+    """
+    with _memo_lock:
+        for key in [k for k in _memo if k[0] == code and (period is None or k[1] == period)]:
+            del _memo[key]
 
 
 def _mock_data() -> pd.DataFrame:
     """生成模拟数据，用于测试或 adata 不可用时"""
     logger.warning("使用模拟数据 (未安装 adata 或取数失败)")
     dates = pd.date_range(end=dt.date.today(), periods=200, freq="B")
-    close = pd.Series(100 + pd.Series(range(len(dates))).rolling(5).mean().fillna(0))
+    # 等价于 range(n) 的 5 日均线 (前 4 个值填 0) 再加 100
+    idx = np.arange(len(dates), dtype=np.float64)
+    close = 100.0 + np.where(idx >= 4, idx - 2, 0.0)
     df = pd.DataFrame(
         {
             "date": dates,
@@ -74,75 +240,69 @@ def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     标准化列名
     adata返回的列名可能是中文或英文，统一转换为英文小写
     """
-    # 定义日期列的优先级（从高到低）
-    date_columns = ["trade_time", "trade_date", "日期", "时间", "date", "Date"]
-    
-    # 找到第一个存在的日期列
-    date_col = None
-    for col in date_columns:
-        if col in df.columns:
-            date_col = col
-            break
+    # 找到第一个存在的日期列，只映射这一列
+    date_col = next((col for col in _DATE_COLUMNS if col in df.columns), None)
     
-    # 标准列名映射
-    column_map = {
-        # 价格相关
-        "开盘": "open",
-        "open": "open",
-        "Open": "open",
-        "收盘": "close",
-        "close": "close",
-        "Close": "close",
-        "最高": "high",
-        "high": "high",
-        "High": "high",
-        "最低": "low",
-        "low": "low",
-        "Low": "low",
-        # 成交量
-        "成交量": "volume",
-        "volume": "volume",
-        "Volume": "volume",
-    }
-    
-    # 只映射第一个找到的日期列
+    columns = [_COLUMN_MAP.get(col, col) for col in df.columns]
     if date_col and date_col != "date":
-        column_map[date_col] = "date"
-    
-    # 重命名列
-    df = df.rename(columns={col: column_map.get(col, col) for col in df.columns})
+        columns = ["date" if col == date_col else new for col, new in zip(df.columns, columns)]
+    df = df.copy(deep=False)
+    df.columns = columns
     
     # 如果有重复的 date 列，只保留第一个
-    if "date" in df.columns and df.columns.tolist().count("date") > 1:
-        # 找到所有 date 列的位置
-        date_indices = [i for i, col in enumerate(df.columns) if col == "date"]
-        # 删除除第一个之外的所有 date 列
-        cols_to_keep = [i for i in range(len(df.columns)) if i not in date_indices[1:]]
-        df = df.iloc[:, cols_to_keep]
+    if df.columns.has_duplicates:
+        df = df.loc[:, ~(df.columns.duplicated() & (df.columns == "date"))]
     
     return df
 
 
+def _detect_date_format(values) -> str:
+    """根据第一个非空样本推断日期格式，无法匹配时返回 'mixed'"""
+    sample = next((v for v in values if isinstance(v, str)), None)
+    if sample is not None:
+        for fmt in _INFER_FORMATS:
+            try:
+                dt.datetime.strptime(sample, fmt)
+                return fmt
+            except ValueError:
+                continue
+    return "mixed"
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """
+    解析日期列
+    行情数据中日期大量重复，只解析去重后的值再按编码展开
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    codes, uniques = pd.factorize(values)
+    parsed = None
+    if ciso8601 is not None and all(isinstance(v, str) for v in uniques):
+        try:
+            parsed = pd.DatetimeIndex([ciso8601.parse_datetime(v) for v in uniques])
+        except ValueError:
+            parsed = None
+    if parsed is None:
+        fmt = _detect_date_format(uniques)
+        parsed = pd.DatetimeIndex(pd.to_datetime(uniques, format=fmt, errors="coerce", cache=True))
+    return pd.Series(parsed.take(codes, allow_fill=True, fill_value=pd.NaT), index=values.index, name=values.name)
+
+
+def _format_timestamps(dates: pd.Series) -> pd.Series:
+    """将日期列格式化为 'YYYY-MM-DD' 字符串，NaT 保持为空"""
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        return dates.dt.strftime("%Y-%m-%d")
+    days = dates.to_numpy(dtype="datetime64[D]").astype("U10")
+    return pd.Series(days, index=dates.index, name=dates.name).where(dates.notna())
+
+
 def _period_to_k_type(period: str) -> int:
     """
     将周期字符串转换为adata的k_type参数
     k_type: 1=日K, 2=周K, 3=月K
     """
-    period_map = {
-        "daily": 1,
-        "day": 1,
-        "d": 1,
-        "1d": 1,
-        "weekly": 2,
-        "week": 2,
-        "w": 2,
-        "1w": 2,
-        "monthly": 3,
-        "month": 3,
-        "m": 3,
-        "1m": 3,
-    }
-    return period_map.get(period.lower(), 1)
+    return _PERIOD_MAP.get(period.lower(), 1)
 
 
 def _fetch_from_adata(
@@ -198,36 +358,43 @@ def _fetch_from_adata(
         return None
 
 
-def fetch_stock_data(
+@contextmanager
+def _key_lock(key: Hashable) -> Iterator[None]:
+    """持有某个键专属的锁，用于合并并发的重复拉取或串行化同一文件的写入"""
+    with _key_locks_guard:
+        entry = _key_locks.get(key)
+        if entry is None:
+            entry = _key_locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _key_locks[key]
+
+
+def _lookup_cache(key: _MemoKey) -> Optional[pd.DataFrame]:
+    """依次查找进程内缓存和缓存文件"""
+    memo = _memo_get(key)
+    if memo is not None:
+        return memo
+    cached = _load_cache(key[0], key[1])
+    if cached is not None:
+        _memo_put(key, cached)
+        return cached.copy(deep=False)
+    return None
+
+
+def _fetch_fresh(
     code: str, 
     period: str = "daily", 
     start: Optional[str] = None, 
-    end: Optional[str] = None,
-    use_cache: bool = True
+    end: Optional[str] = None
 ) -> pd.DataFrame:
-    """
-    获取股票行情数据（带缓存）
-    
-    Args:
-        code: 股票代码，如 '000001' (平安银行)
-        period: 周期类型，支持 'daily', 'weekly', 'monthly'
-        start: 开始日期，格式 'YYYY-MM-DD'
-        end: 结束日期，格式 'YYYY-MM-DD'
-        use_cache: 是否使用缓存
-    
-    Returns:
-        DataFrame，包含 date, open, high, low, close, volume 等列
-    
-    Examples:
-        >>> df = fetch_stock_data('000001', period='daily', start='2021-01-01')
-        >>> print(df.head())
-    """
-    # 尝试从缓存加载
-    if use_cache:
-        cached = _load_cache(code, period)
-        if cached is not None:
-            return cached
-    
+    """从 adata 拉取数据并完成列名、日期与排序的标准化"""
     # 从 adata 获取数据
     df = _fetch_from_adata(code=code, period=period, start=start, end=end)
     
@@ -247,26 +414,75 @@ def fetch_stock_data(
     
     # 转换日期格式
     try:
-        df["date"] = pd.to_datetime(df["date"], errors='coerce')
+        df["date"] = _parse_dates(df["date"])
     except Exception as exc:
         logger.error("日期转换失败: %s", exc)
         # 尝试其他常见的日期列
         possible_date_cols = [col for col in df.columns if 'date' in col.lower() or 'time' in col.lower()]
         if possible_date_cols:
             logger.info("尝试使用列: %s", possible_date_cols[0])
-            df["date"] = pd.to_datetime(df[possible_date_cols[0]], errors='coerce')
+            df["date"] = _parse_dates(df[possible_date_cols[0]])
         else:
             logger.error("无法找到合适的日期列，使用模拟数据")
             df = _mock_data()
     
-    df = df.sort_values("date").reset_index(drop=True)
-    df["timestamp"] = df["date"].dt.strftime("%Y-%m-%d")
+    # 缓存与 adata 返回的数据通常已按日期排好，跳过重复排序
+    if not df["date"].is_monotonic_increasing:
+        df = df.sort_values("date", kind="mergesort")
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        df = df.reset_index(drop=True)
+    df["timestamp"] = _format_timestamps(df["date"])
+    return df
+
+
+def fetch_stock_data(
+    code: str, 
+    period: str = "daily", 
+    start: Optional[str] = None, 
+    end: Optional[str] = None,
+    use_cache: bool = True
+) -> pd.DataFrame:
+    """
+    获取股票行情数据（带缓存）
+    同一 (code, period, start, end) 的并发请求只有一个会真正拉取数据
+    
+    Args:
+        code: 股票代码，如 '000001' (平安银行)
+        period: 周期类型，支持 'daily', 'weekly', 'monthly'
+        start: 开始日期，格式 'YYYY-MM-DD'
+        end: 结束日期，格式 'YYYY-MM-DD'
+        use_cache: 是否使用缓存
     
-    # 保存到缓存
+    Returns:
+        DataFrame，包含 date, open, high, low, close, volume 等列
+    
+    Examples:
+        >>> df = fetch_stock_data('000001', period='daily', start='2021-01-01')
+        >>> print(df.head())
+    """
+    memo_key = (code, period, start, end)
+
+    # 尝试从缓存加载
     if use_cache:
-        _save_cache(code, period, df)
+        cached = _lookup_cache(memo_key)
+        if cached is not None:
+            return cached
     
-    return df
+    with _key_lock(memo_key):
+        # 等待锁期间其他线程可能已完成拉取，再检查一次缓存
+        if use_cache:
+            cached = _lookup_cache(memo_key)
+            if cached is not None:
+                return cached
+        
+        df = _fetch_fresh(code=code, period=period, start=start, end=end)
+        
+        # 保存到缓存
+        if use_cache:
+            _save_cache(code, period, df)
+        _memo_put(memo_key, df)
+    
+    return df.copy(deep=False)
 
 
 def get_stock_list() -> pd.DataFrame:
@@ -293,9 +509,23 @@ def get_stock_list() -> pd.DataFrame:
         return pd.DataFrame(columns=["stock_code", "short_name", "exchange"])
 
 
+def _fetch_quote_chunk(codes: list[str]) -> Optional[pd.DataFrame]:
+    """请求一批实时行情，失败时带随机退避重试"""
+    for attempt in range(REALTIME_MAX_RETRIES + 1):
+        try:
+            return adata.stock.market.list_market_current(stock_codes=codes)
+        except Exception as exc:
+            if attempt == REALTIME_MAX_RETRIES:
+                logger.error("获取实时行情失败: %s", exc)
+                return None
+            time.sleep(0.2 * (2 ** attempt) + random.uniform(0, 0.2))
+    return None
+
+
 def get_realtime_quote(codes: list[str]) -> pd.DataFrame:
     """
     获取多只股票的实时行情
+    代码较多时按 REALTIME_CHUNK_SIZE 分批并发请求
     
     Args:
         codes: 股票代码列表，如 ['000001', '000002']
@@ -311,10 +541,16 @@ def get_realtime_quote(codes: list[str]) -> pd.DataFrame:
         logger.error("adata 未安装")
         return pd.DataFrame()
     
-    try:
-        df = adata.stock.market.list_market_current(stock_codes=codes)
-        logger.info("获取到 %d 只股票的实时行情", len(df))
-        return df
-    except Exception as exc:
-        logger.error("获取实时行情失败: %s", exc)
+    chunks = [codes[i:i + REALTIME_CHUNK_SIZE] for i in range(0, len(codes), REALTIME_CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        parts = [_fetch_quote_chunk(codes)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(REALTIME_MAX_WORKERS, len(chunks))) as executor:
+            parts = list(executor.map(_fetch_quote_chunk, chunks))
+    
+    parts = [part for part in parts if part is not None and not part.empty]
+    if not parts:
         return pd.DataFrame()
+    df = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+    logger.info("获取到 %d 只股票的实时行情", len(df))
+    return df
@@ -1,7 +1,11 @@
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Dict, List, Literal, Optional
+from typing import Dict, List, Literal, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 
 try:
@@ -9,17 +13,85 @@ try:
 except Exception:  # noqa: BLE001
     ta = None
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 
 logger = logging.getLogger(__name__)
 
 PlotType = Literal["overlay", "oscillator"]
 
 
+def _series_of(timestamps: List[str], values: np.ndarray) -> List[dict]:
+    values = np.asarray(values, dtype=np.float64)
+    boxed = values.astype(object)
+    boxed[np.isnan(values)] = None
+    return [{"time": ts, "value": value} for ts, value in zip(timestamps, boxed.tolist())]
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def _kdj_j_kernel(k, d, out):
+        for i in range(k.shape[0]):
+            out[i] = 3.0 * k[i] - 2.0 * d[i]
+
+    @njit(cache=True)
+    def _window_mean_kernel(csum, nan_count, window, out):
+        for i in range(window - 1, out.shape[0]):
+            if nan_count[i + 1] - nan_count[i + 1 - window] == 0:
+                out[i] = (csum[i + 1] - csum[i + 1 - window]) / window
+
+
+def _kdj_j(k: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """J = 3K - 2D，单次遍历写入同一个输出数组"""
+    out = np.empty_like(k)
+    if njit is not None:
+        _kdj_j_kernel(k, d, out)
+    else:
+        np.multiply(k, 3.0, out=out)
+        np.subtract(out, d, out=out)
+        np.subtract(out, d, out=out)
+    return out
+
+
+def rolling_means(values: np.ndarray, windows: List[int]) -> Dict[int, np.ndarray]:
+    """
+    基于同一组前缀和计算多个窗口的滑动平均
+    窗口内含 NaN 时结果为 NaN，与 rolling(window).mean() 一致
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[0]
+    missing = np.isnan(values)
+    csum = np.zeros(n + 1)
+    np.cumsum(np.where(missing, 0.0, values), out=csum[1:])
+    nan_count = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(missing, out=nan_count[1:])
+    means: Dict[int, np.ndarray] = {}
+    for window in windows:
+        out = np.full(n, np.nan)
+        if 0 < window <= n and njit is not None:
+            _window_mean_kernel(csum, nan_count, window, out)
+        elif 0 < window <= n:
+            window_sum = csum[window:] - csum[:-window]
+            complete = (nan_count[window:] - nan_count[:-window]) == 0
+            out[window - 1:] = np.where(complete, window_sum / window, np.nan)
+        means[window] = out
+    return means
+
+
 @dataclass
 class IndicatorResult:
     name: str
     plot_type: PlotType
-    series: Dict[str, List[dict]]
+    timestamps: List[str]
+    series: Dict[str, np.ndarray]
+
+    def to_chart_payload(self) -> Dict[str, List[dict]]:
+        """展开为 lightweight-charts 需要的 [{"time", "value"}] 形式"""
+        return {name: _series_of(self.timestamps, values) for name, values in self.series.items()}
 
 
 @dataclass
@@ -29,6 +101,7 @@ class BaseIndicator:
     plot_type: PlotType = "overlay"
 
     def calculate(self, df: pd.DataFrame) -> Optional[IndicatorResult]:
+        """计算指标，实现方只读取 df，不得修改"""
         raise NotImplementedError
 
 
@@ -39,15 +112,11 @@ class MAIndicator(BaseIndicator):
 
     def calculate(self, df: pd.DataFrame) -> Optional[IndicatorResult]:
         periods = self.params.get("periods", [])
-        series: Dict[str, List[dict]] = {}
-        for period in periods:
-            col = f"ma_{period}"
-            df[col] = df["close"].rolling(window=period).mean()
-            series[col.upper()] = [
-                {"time": row["timestamp"], "value": None if pd.isna(row[col]) else float(row[col])}
-                for _, row in df.iterrows()
-            ]
-        return IndicatorResult(name=self.name, plot_type=self.plot_type, series=series)
+        means = rolling_means(df["close"].to_numpy(dtype=np.float64), periods)
+        series = {f"MA_{period}": means[period] for period in periods}
+        return IndicatorResult(
+            name=self.name, plot_type=self.plot_type, timestamps=df["timestamp"].tolist(), series=series
+        )
 
 
 class MACDIndicator(BaseIndicator):
@@ -62,22 +131,14 @@ class MACDIndicator(BaseIndicator):
         macd = ta.macd(df["close"], fast=self.params["fast"], slow=self.params["slow"], signal=self.params["signal"])
         if macd is None:
             return None
-        df = df.join(macd)
         series = {
-            "MACD": [
-                {"time": row["timestamp"], "value": None if pd.isna(row["MACD_12_26_9"]) else float(row["MACD_12_26_9"])}
-                for _, row in df.iterrows()
-            ],
-            "SIGNAL": [
-                {"time": row["timestamp"], "value": None if pd.isna(row["MACDs_12_26_9"]) else float(row["MACDs_12_26_9"])}
-                for _, row in df.iterrows()
-            ],
-            "HIST": [
-                {"time": row["timestamp"], "value": None if pd.isna(row["MACDh_12_26_9"]) else float(row["MACDh_12_26_9"])}
-                for _, row in df.iterrows()
-            ],
+            "MACD": macd["MACD_12_26_9"].to_numpy(dtype=np.float64),
+            "SIGNAL": macd["MACDs_12_26_9"].to_numpy(dtype=np.float64),
+            "HIST": macd["MACDh_12_26_9"].to_numpy(dtype=np.float64),
         }
-        return IndicatorResult(name=self.name, plot_type=self.plot_type, series=series)
+        return IndicatorResult(
+            name=self.name, plot_type=self.plot_type, timestamps=df["timestamp"].tolist(), series=series
+        )
 
 
 class KDJIndicator(BaseIndicator):
@@ -92,26 +153,15 @@ class KDJIndicator(BaseIndicator):
         kdj = ta.stoch(df["high"], df["low"], df["close"], k=self.params["smooth_k"], d=self.params["smooth_d"], length=self.params["length"])
         if kdj is None:
             return None
-        df = df.join(kdj)
-        k_col = [col for col in df.columns if col.startswith("STOCHk")][-1]
-        d_col = [col for col in df.columns if col.startswith("STOCHd")][-1]
-        j_col = "J"
-        df[j_col] = 3 * df[k_col] - 2 * df[d_col]
-        series = {
-            "K": [
-                {"time": row["timestamp"], "value": None if pd.isna(row[k_col]) else float(row[k_col])}
-                for _, row in df.iterrows()
-            ],
-            "D": [
-                {"time": row["timestamp"], "value": None if pd.isna(row[d_col]) else float(row[d_col])}
-                for _, row in df.iterrows()
-            ],
-            "J": [
-                {"time": row["timestamp"], "value": None if pd.isna(row[j_col]) else float(row[j_col])}
-                for _, row in df.iterrows()
-            ],
-        }
-        return IndicatorResult(name=self.name, plot_type=self.plot_type, series=series)
+        k_col = [col for col in kdj.columns if col.startswith("STOCHk")][-1]
+        d_col = [col for col in kdj.columns if col.startswith("STOCHd")][-1]
+        k_values = kdj[k_col].to_numpy(dtype=np.float64)
+        d_values = kdj[d_col].to_numpy(dtype=np.float64)
+        j_values = _kdj_j(k_values, d_values)
+        series = {"K": k_values, "D": d_values, "J": j_values}
+        return IndicatorResult(
+            name=self.name, plot_type=self.plot_type, timestamps=df["timestamp"].tolist(), series=series
+        )
 
 
 class RSIIndicator(BaseIndicator):
@@ -126,19 +176,25 @@ class RSIIndicator(BaseIndicator):
         rsi = ta.rsi(df["close"], length=self.params["length"])
         if rsi is None:
             return None
-        df = df.assign(RSI=rsi)
-        series = {
-            "RSI": [
-                {"time": row["timestamp"], "value": None if pd.isna(row["RSI"]) else float(row["RSI"])}
-                for _, row in df.iterrows()
-            ]
-        }
-        return IndicatorResult(name=self.name, plot_type=self.plot_type, series=series)
+        series = {"RSI": rsi.to_numpy(dtype=np.float64)}
+        return IndicatorResult(
+            name=self.name, plot_type=self.plot_type, timestamps=df["timestamp"].tolist(), series=series
+        )
 
 
 class IndicatorRegistry:
-    def __init__(self) -> None:
+    def __init__(self, max_workers: Optional[int] = None) -> None:
         self.indicators: Dict[str, BaseIndicator] = {}
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # 所有请求共享同一个线程池，避免每次计算都创建、销毁线程
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="indicator")
+            return self._executor
 
     def register(self, indicator: BaseIndicator) -> None:
         self.indicators[indicator.name] = indicator
@@ -150,17 +206,20 @@ class IndicatorRegistry:
             for name, indicator in self.indicators.items()
         ]
 
-    def calculate(self, names: List[str], df: pd.DataFrame) -> List[IndicatorResult]:
-        results: List[IndicatorResult] = []
+    def calculate(self, names: Sequence[str], df: pd.DataFrame) -> List[IndicatorResult]:
+        selected: List[BaseIndicator] = []
         for name in names:
             indicator = self.indicators.get(name)
             if not indicator:
                 logger.warning("未找到指标: %s", name)
                 continue
-            result = indicator.calculate(df.copy())
-            if result:
-                results.append(result)
-        return results
+            selected.append(indicator)
+        if len(selected) <= 1 or self.max_workers <= 1:
+            outputs = [indicator.calculate(df) for indicator in selected]
+        else:
+            # 各指标只读 df，且 rolling/EMA 在 C 层释放 GIL，可并行计算
+            outputs = list(self._get_executor().map(lambda indicator: indicator.calculate(df), selected))
+        return [result for result in outputs if result]
 
 
 def build_registry() -> IndicatorRegistry:
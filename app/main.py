@@ -1,16 +1,29 @@
 import datetime as dt
+import hashlib
 import logging
-from typing import List, Optional
-
-
-from fastapi import FastAPI, Query, Request
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import Any, Callable, List, Optional, Tuple
+
+import anyio
+import numpy as np
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
 
 from app.data import fetch_stock_data
-from app.indicators import IndicatorResult, build_registry
+from app.indicators import IndicatorResult, build_registry, rolling_means
 from app.report import render_html_report, render_markdown_report
 
 
@@ -25,28 +38,78 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 registry = build_registry()
 
 templates = Jinja2Templates(directory="templates")
 
-
-
-def _build_candles(df) -> List[dict]:
-    return [
-        {
-            "time": row["timestamp"],
-            "open": float(row["open"]),
-            "high": float(row["high"]),
-            "low": float(row["low"]),
-            "close": float(row["close"]),
-            "volume": float(row["volume"]),
-        }
-        for _, row in df.iterrows()
-    ]
-
-
-def _detect_cross(series_short: List[float], series_long: List[float], name: str) -> List[str]:
+# 取数与指标计算在线程中执行，限制并发数量以免冲击上游数据源
+blocking_limiter = anyio.CapacityLimiter(16)
+
+# 指标计算结果缓存: 按 (代码, 周期, 指标, 数据指纹) 复用，过期时间(秒)
+INDICATOR_CACHE_MAX_ENTRIES = 256
+INDICATOR_CACHE_TTL_SECONDS = 60
+_indicator_cache: "OrderedDict[tuple, Tuple[float, List[IndicatorResult]]]" = OrderedDict()
+_indicator_cache_lock = threading.Lock()
+
+# 报告接口的 HTTP 缓存头，配合 ETag 返回 304
+REPORT_CACHE_HEADERS = {"Cache-Control": "max-age=60"}
+
+
+
+@lru_cache(maxsize=256)
+def _parse_indicator_list(indicators: str) -> Tuple[str, ...]:
+    """解析逗号分隔的指标名，去重、转大写并排序，保证等价写法得到同一结果"""
+    return tuple(sorted({name.strip().upper() for name in indicators.split(",") if name.strip()}))
+
+
+def _calculate_indicators(code: str, period: str, names: Tuple[str, ...], df) -> List[IndicatorResult]:
+    """带 TTL 缓存的 registry.calculate，数据指纹为行数与最后一根K线"""
+    if not names:
+        return []
+    last = (df["timestamp"].iloc[-1], float(df["close"].iloc[-1])) if len(df) else None
+    key = (code, period, names, len(df), last)
+    now = time.monotonic()
+    with _indicator_cache_lock:
+        entry = _indicator_cache.get(key)
+        if entry is not None and now - entry[0] <= INDICATOR_CACHE_TTL_SECONDS:
+            _indicator_cache.move_to_end(key)
+            return entry[1]
+    results = registry.calculate(names, df)
+    with _indicator_cache_lock:
+        _indicator_cache[key] = (now, results)
+        _indicator_cache.move_to_end(key)
+        while len(_indicator_cache) > INDICATOR_CACHE_MAX_ENTRIES:
+            _indicator_cache.popitem(last=False)
+    return results
+
+
+def _build_candles(df) -> dict:
+    """按列输出K线数据: {"time": [...], "open": [...], ...}，价格保留 4 位小数"""
+    candles = {"time": df["timestamp"].tolist()}
+    for col in ("open", "high", "low", "close"):
+        candles[col] = np.round(df[col].to_numpy(dtype=np.float64, na_value=np.nan), 4).tolist()
+    candles["volume"] = df["volume"].to_numpy(dtype=np.float64, na_value=np.nan).tolist()
+    return candles
+
+
+def _build_arrow_stream(df, indicator_results: List[IndicatorResult]) -> bytes:
+    """K线与指标序列作为列写入 Arrow IPC 流，指标列名为 '<指标>.<序列>'，NaN 写为 null"""
+    columns = {"time": pyarrow.array(df["timestamp"].tolist(), type=pyarrow.string(), from_pandas=True)}
+    for col in ("open", "high", "low", "close", "volume"):
+        columns[col] = pyarrow.array(df[col].to_numpy(dtype=np.float64, na_value=np.nan), from_pandas=True)
+    for result in indicator_results:
+        for key, values in result.series.items():
+            columns[f"{result.name}.{key}"] = pyarrow.array(values, from_pandas=True)
+    table = pyarrow.table(columns)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _detect_cross(series_short: np.ndarray, series_long: np.ndarray, name: str) -> List[str]:
     signals: List[str] = []
     if len(series_short) < 2 or len(series_long) < 2:
         return signals
@@ -57,11 +120,25 @@ def _detect_cross(series_short: List[float], series_long: List[float], name: str
     return signals
 
 
-def _extract_series(indicators: List[IndicatorResult], name: str) -> Optional[IndicatorResult]:
-    for indicator in indicators:
-        if indicator.name == name:
-            return indicator
-    return None
+def _report_etag(df, *parts: str) -> str:
+    """
+    以最后一根K线、行数与请求参数生成弱 ETag，数据未变化时保持不变
+    报告正文含生成时间且可能经过 gzip 压缩，字节不恒定，因此只能作为弱校验器
+    """
+    last = f"{df['timestamp'].iloc[-1]}|{df['close'].iloc[-1]}" if len(df) else ""
+    key = "|".join([last, str(len(df)), *parts]).encode("utf-8")
+    return 'W/"' + hashlib.blake2b(key, digest_size=8).hexdigest() + '"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match 使用弱比较: 忽略两侧的 W/ 前缀
+    opaque = etag.removeprefix("W/")
+    header = request.headers.get("if-none-match", "")
+    return any(tag.strip().removeprefix("W/") in (opaque, "*") for tag in header.split(",") if tag.strip())
+
+
+async def _run_blocking(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await anyio.to_thread.run_sync(partial(func, *args, **kwargs), limiter=blocking_limiter)
 
 
 @app.get("/api/health")
@@ -86,16 +163,21 @@ def indicator_config() -> dict:
 
 
 @app.get("/api/data")
-def stock_data(
+async def stock_data(
     code: str,
     period: str = Query("daily", description="daily/weekly/monthly"),
     indicators: str = Query("", description="逗号分隔的指标名"),
     start: Optional[str] = None,
     end: Optional[str] = None,
+) -> dict:
+    return await _run_blocking(_build_data_payload, code, period, indicators, start, end)
+
+
+def _build_data_payload(
+    code: str, period: str, indicators: str, start: Optional[str], end: Optional[str]
 ) -> dict:
     df = fetch_stock_data(code=code, period=period, start=start, end=end)
-    indicator_list = [name.strip() for name in indicators.split(",") if name.strip()]
-    indicator_results = registry.calculate(indicator_list, df)
+    indicator_results = _calculate_indicators(code, period, _parse_indicator_list(indicators), df)
 
     return {
         "code": code,
@@ -105,83 +187,138 @@ def stock_data(
             {
                 "name": result.name,
                 "type": result.plot_type,
-                "series": result.series,
+                "series": result.to_chart_payload(),
             }
             for result in indicator_results
         ],
     }
 
 
+@app.get("/api/data.arrow")
+async def stock_data_arrow(
+    code: str,
+    period: str = Query("daily", description="daily/weekly/monthly"),
+    indicators: str = Query("", description="逗号分隔的指标名"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> Response:
+    if pyarrow is None:
+        raise HTTPException(status_code=501, detail="pyarrow 未安装，无法输出 Arrow 格式")
+    body = await _run_blocking(_build_data_arrow, code, period, indicators, start, end)
+    return Response(body, media_type="application/vnd.apache.arrow.stream")
+
+
+def _build_data_arrow(
+    code: str, period: str, indicators: str, start: Optional[str], end: Optional[str]
+) -> bytes:
+    df = fetch_stock_data(code=code, period=period, start=start, end=end)
+    return _build_arrow_stream(df, _calculate_indicators(code, period, _parse_indicator_list(indicators), df))
+
+
 @app.get("/api/signals")
-def signals(
+async def signals(
     code: str,
     period: str = Query("daily", description="daily/weekly/monthly"),
     ma_short: int = 10,
     ma_long: int = 30,
 ) -> dict:
+    return await _run_blocking(_build_signals_payload, code, period, ma_short, ma_long)
+
+
+def _build_signals_payload(code: str, period: str, ma_short: int = 10, ma_long: int = 30) -> dict:
     df = fetch_stock_data(code=code, period=period)
-    df["ma_short"] = df["close"].rolling(window=ma_short).mean()
-    df["ma_long"] = df["close"].rolling(window=ma_long).mean()
+    return {"code": code, "period": period, "signals": _compute_signals(df, ma_short, ma_long)}
+
+
+def _compute_signals(
+    df,
+    ma_short: int = 10,
+    ma_long: int = 30,
+    indicator_results: Optional[List[IndicatorResult]] = None,
+) -> List[str]:
+    """基于已获取的行情计算信号，indicator_results 中缺少 MACD/RSI 时补算"""
+    # 交叉判断只需要最后两个点，均线只在尾部窗口上计算
+    tail = df["close"].to_numpy(dtype=np.float64, na_value=np.nan)[-(max(ma_short, ma_long) + 1):]
+    means = rolling_means(tail, [ma_short, ma_long])
     signals_list: List[str] = []
 
     signals_list.extend(
-        _detect_cross(df["ma_short"].fillna(0).tolist(), df["ma_long"].fillna(0).tolist(), f"MA{ma_short}/MA{ma_long}")
+        _detect_cross(
+            np.nan_to_num(means[ma_short][-2:], nan=0.0),
+            np.nan_to_num(means[ma_long][-2:], nan=0.0),
+            f"MA{ma_short}/MA{ma_long}",
+        )
     )
 
-    indicator_results = registry.calculate(["MACD", "RSI"], df)
-    macd = _extract_series(indicator_results, "MACD")
+    by_name = {result.name: result for result in indicator_results or []}
+    missing = [name for name in ("MACD", "RSI") if name not in by_name]
+    if missing:
+        by_name.update((result.name, result) for result in registry.calculate(missing, df))
+    macd = by_name.get("MACD")
     if macd:
-        macd_line = [point["value"] or 0 for point in macd.series["MACD"]]
-        signal_line = [point["value"] or 0 for point in macd.series["SIGNAL"]]
+        macd_line = np.nan_to_num(macd.series["MACD"][-2:], nan=0.0)
+        signal_line = np.nan_to_num(macd.series["SIGNAL"][-2:], nan=0.0)
         signals_list.extend(_detect_cross(macd_line, signal_line, "MACD"))
-    rsi = _extract_series(indicator_results, "RSI")
+    rsi = by_name.get("RSI")
     if rsi:
-        latest_rsi = rsi.series["RSI"][-1]["value"]
-        if latest_rsi is not None:
+        latest_rsi = float(rsi.series["RSI"][-1])
+        if not np.isnan(latest_rsi):
             if latest_rsi > 80:
                 signals_list.append("RSI 超买 (>80)")
             if latest_rsi < 20:
                 signals_list.append("RSI 超卖 (<20)")
 
-    return {"code": code, "period": period, "signals": signals_list}
+    return signals_list
 
 
 @app.get("/api/report/markdown", response_class=PlainTextResponse)
-def report_markdown(
+async def report_markdown(
+    request: Request,
     code: str,
     period: str = Query("daily", description="daily/weekly/monthly"),
     indicators: str = Query("MA,MACD,RSI", description="逗号分隔的指标名"),
-) -> str:
-    payload = _build_report_payload(code, period, indicators)
-    return render_markdown_report(payload)
+) -> Response:
+    df = await _run_blocking(fetch_stock_data, code=code, period=period)
+    etag = _report_etag(df, "markdown", code, period, *_parse_indicator_list(indicators))
+    headers = {"ETag": etag, **REPORT_CACHE_HEADERS}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    payload = await _run_blocking(_build_report_payload, code, period, indicators, df)
+    return PlainTextResponse(render_markdown_report(payload), headers=headers)
 
 
 @app.get("/api/report/html", response_class=HTMLResponse)
-def report_html(
+async def report_html(
+    request: Request,
     code: str,
     period: str = Query("daily", description="daily/weekly/monthly"),
     indicators: str = Query("MA,MACD,RSI", description="逗号分隔的指标名"),
-) -> str:
-    payload = _build_report_payload(code, period, indicators)
-    return render_html_report(payload)
-
-
-def _build_report_payload(code: str, period: str, indicators: str) -> dict:
-    df = fetch_stock_data(code=code, period=period)
-    indicator_list = [name.strip() for name in indicators.split(",") if name.strip()]
-    indicator_results = registry.calculate(indicator_list, df)
-    signals_list = signals(code=code, period=period)["signals"]
+) -> Response:
+    df = await _run_blocking(fetch_stock_data, code=code, period=period)
+    etag = _report_etag(df, "html", code, period, *_parse_indicator_list(indicators))
+    headers = {"ETag": etag, **REPORT_CACHE_HEADERS}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    payload = await _run_blocking(_build_report_payload, code, period, indicators, df)
+    return HTMLResponse(await _run_blocking(render_html_report, payload), headers=headers)
+
+
+def _build_report_payload(code: str, period: str, indicators: str, df=None) -> dict:
+    if df is None:
+        df = fetch_stock_data(code=code, period=period)
+    indicator_results = _calculate_indicators(code, period, _parse_indicator_list(indicators), df)
+    signals_list = _compute_signals(df, indicator_results=indicator_results)
 
     return {
         "code": code,
         "period": period,
-        "generated_at": dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "generated_at": dt.datetime.now().isoformat(sep=" ", timespec="seconds"),
         "candles": _build_candles(df),
         "indicators": [
             {
                 "name": result.name,
                 "type": result.plot_type,
-                "series": result.series,
+                "series": result.to_chart_payload(),
             }
             for result in indicator_results
         ],
@@ -1,9 +1,14 @@
 import json
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict
 
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 template_dir = Path(__file__).resolve().parent.parent / "templates"
 
@@ -11,26 +16,35 @@ template_dir = Path(__file__).resolve().parent.parent / "templates"
 env = Environment(
     loader=FileSystemLoader(template_dir),
     autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    cache_size=400,
 )
 
+_REPORT_TEMPLATE = env.get_template("report_template.html")
+
+
+def _dumps_payload(payload: Dict[str, Any]) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    return json.dumps(payload, ensure_ascii=False)
+
 
 def render_html_report(payload: Dict[str, Any]) -> str:
-    template = env.get_template("report_template.html")
-    return template.render(payload_json=json.dumps(payload, ensure_ascii=False))
+    return _REPORT_TEMPLATE.render(payload_json=_dumps_payload(payload))
 
 
 def render_markdown_report(payload: Dict[str, Any]) -> str:
-    lines: List[str] = []
-    lines.append(f"# {payload['code']} 分析报告")
-    lines.append("")
-    lines.append(f"- 周期: {payload['period']}")
-    lines.append(f"- 生成时间: {payload['generated_at']}")
-    lines.append("")
-    lines.append("## 信号摘要")
-    for signal in payload.get("signals", []):
-        lines.append(f"- {signal}")
-    lines.append("")
-    lines.append("## 指标概览")
-    for indicator in payload.get("indicators", []):
-        lines.append(f"- {indicator['name']} ({indicator['type']})")
-    return "\n".join(lines)
+    header = (
+        f"# {payload['code']} 分析报告\n\n"
+        f"- 周期: {payload['period']}\n"
+        f"- 生成时间: {payload['generated_at']}\n\n"
+        "## 信号摘要"
+    )
+    return "\n".join(
+        [
+            header,
+            *(f"- {signal}" for signal in payload.get("signals", [])),
+            "\n## 指标概览",
+            *(f"- {indicator['name']} ({indicator['type']})" for indicator in payload.get("indicators", [])),
+        ]
+    )